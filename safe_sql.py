@@ -1,19 +1,23 @@
 # Utilities for preventing SQL injection in dynamically composed SQL statements executed on SqlServer via pyodbc.
 #
 from abc import ABC, abstractmethod
-from collections.abc import Sequence
+from array import array
+from collections.abc import Iterator, Sequence
+from dataclasses import dataclass, field
 from enum import Enum
-from itertools import chain
+from functools import lru_cache
+from sys import intern
 from typing import Any, ClassVar, Union
 
-from pydantic import BaseModel, model_validator
-
 
 # alias informing the developers that they are responsible for the safety of a string
 DeveloperCheckedStr = str
 
 
 class SafeSqlBuilder(ABC):
+    # empty slots on the base so subclasses with __slots__ really drop their __dict__
+    __slots__ = ()
+
     PYODBC_PARAM_PLACEHOLDER: ClassVar[str] = "?"
     MSSQL_MAX_PARAMS: ClassVar[int] = 2100
 
@@ -29,45 +33,55 @@ class SafeSqlBuilder(ABC):
         pass
 
 
+# prebuilt type tuples, so the per-element isinstance checks skip tuple construction
+_SAFESQL_PART_TYPES = (SafeSqlBuilder, DeveloperCheckedStr)
+
+
 class SafeSql(SafeSqlBuilder):
     """
     Class for combining multiple SQL snippets into a SQL snippet
     invulnerable to SQL injection.
     """
+    __slots__ = ('parts',)
 
     def __init__(self, *parts: Union[SafeSqlBuilder, DeveloperCheckedStr]):
-        # Validate that snippets is a sequence
-        if not isinstance(parts, Sequence):
-            raise TypeError(f"snippets must be a Sequence, got {type(parts).__name__}")
-
-        # Validate each element
-        for i, part in enumerate(parts):
-            if not isinstance(part, (SafeSqlBuilder, DeveloperCheckedStr)):
-                raise TypeError(
-                    f"Each snippet must be SafeSqlBuilder or DeveloperCheckedStr, "
-                    f"but element {i} is {type(part).__name__}"
-                )
-
-        self.parts = parts
+        # Validate all elements with one short-circuiting pass; only re-scan with
+        # enumerate on the (rare) error path to report the offending index
+        if not all(type(p) is str or isinstance(p, _SAFESQL_PART_TYPES) for p in parts):
+            for i, part in enumerate(parts):
+                if not isinstance(part, _SAFESQL_PART_TYPES):
+                    raise TypeError(
+                        f"Each snippet must be SafeSqlBuilder or DeveloperCheckedStr, "
+                        f"but element {i} is {type(part).__name__}"
+                    )
+
+        # Splice nested SafeSql parts inline (they were validated on construction),
+        # so _build walks a single flat sequence instead of recursing per level
+        flat: list[Union[SafeSqlBuilder, DeveloperCheckedStr]] = []
+        for part in parts:
+            if isinstance(part, SafeSql):
+                flat.extend(part.parts)
+            else:
+                flat.append(part)
+
+        self.parts = tuple(flat)
 
     def _build(self) -> tuple[str, list[Any]]:
-        def safely_concatenate(left: str, right: str) -> str:
-            """ensure consecutive sql snippets are separated by one space"""
-            if not left:
-                return right.strip()
-            return left + ' ' + right.strip()
-
-        sql: str = ""
+        pieces: list[str] = []
         params: list[Any] = []
         for part in self.parts:
             if isinstance(part, SafeSqlBuilder):
                 added_sql, added_params = part._build()
             else:  # if isinstance(part, str):
                 added_sql, added_params = part, []
-            sql = safely_concatenate(sql, added_sql)
-            params += added_params
+            # collect stripped snippets and join once, so consecutive snippets
+            # end up separated by exactly one space without quadratic re-concatenation
+            stripped = added_sql.strip()
+            if stripped:
+                pieces.append(stripped)
+            params.extend(added_params)
 
-        return sql, params
+        return ' '.join(pieces), params
 
 
 class SafeSqlWildcard(Enum):
@@ -76,26 +90,35 @@ class SafeSqlWildcard(Enum):
     UNDERSCORE = '_'
 
 
+_LIKE_PART_TYPES = (str, SafeSqlWildcard)
+
+
 class SafeSqlLikePattern(SafeSqlBuilder):
     """
     Class producing a safe Sql LIKE pattern.
     Wildcards must be given explicitly with the Wildcard inner class.
     Any wildcard not given explicitly is escaped to prevent context injection.
     """
+    __slots__ = ('parts',)
+
     ESCAPE_CHAR: ClassVar[str] = '['
+    # translation table escaping every special character ([, %, _) in one C-level pass
+    _ESCAPE_TABLE: ClassVar[dict[int, str]] = str.maketrans({'[': '[[', '%': '[%', '_': '[_'})
 
     def __init__(self, *parts: Union[str, 'SafeSqlWildcard']):
         # Validate that we received a sequence of arguments
         if not parts:
             raise TypeError("At least one part must be provided")
 
-        # Validate each element
-        for i, part in enumerate(parts):
-            if not isinstance(part, (str, SafeSqlWildcard)):
-                raise TypeError(
-                    f"Each part must be str or SafeSqlWildcard, "
-                    f"but element {i} is {type(part).__name__}"
-                )
+        # Validate all elements with one short-circuiting pass; only re-scan with
+        # enumerate on the (rare) error path to report the offending index
+        if not all(type(p) is str or isinstance(p, _LIKE_PART_TYPES) for p in parts):
+            for i, part in enumerate(parts):
+                if not isinstance(part, _LIKE_PART_TYPES):
+                    raise TypeError(
+                        f"Each part must be str or SafeSqlWildcard, "
+                        f"but element {i} is {type(part).__name__}"
+                    )
 
         self.parts = parts
 
@@ -105,24 +128,20 @@ class SafeSqlLikePattern(SafeSqlBuilder):
             """get the corresponding safe string and True or False depending on whether any escapes were executed"""
             # escaping unexpected wildcards protects from context injection
             if isinstance(p, str):
-                escaped = ""
-                executed_escapes = False
-                for ch in p:
-                    if ch in (self.ESCAPE_CHAR, '%', '_'):
-                        escaped += self.ESCAPE_CHAR + ch
-                        executed_escapes = True
-                    else:
-                        escaped += ch
-                return escaped, executed_escapes
+                # every escape inserts one extra char, so a length change means escapes happened
+                escaped = p.translate(self._ESCAPE_TABLE)
+                return escaped, len(escaped) != len(p)
             else:  # if isinstance(p, SqlWildcard):
                 return p.value, False
 
+        # collect processed parts and join once instead of growing param per iteration
         any_escape_needed = False
-        param = ""
+        processed: list[str] = []
         for part in self.parts:
             string, escape_needed = process_part(part)
-            param += string
-            any_escape_needed = any_escape_needed or escape_needed
+            processed.append(string)
+            any_escape_needed |= escape_needed
+        param = ''.join(processed)
 
         escape_clause_if_needed = f" ESCAPE '{SafeSqlLikePattern.ESCAPE_CHAR}'" if any_escape_needed else ""
         return self.PYODBC_PARAM_PLACEHOLDER + escape_clause_if_needed, [param]
@@ -130,17 +149,22 @@ class SafeSqlLikePattern(SafeSqlBuilder):
 
 class SafeSqlInt(SafeSqlBuilder):
     """class ensuring that the given value is an int; useful for sanitizing TOP n directives"""
+    __slots__ = ('value', '_str')
+
     def __init__(self, value: int) -> None:
         if not isinstance(value, int):
             raise TypeError(f"value must be int, got {type(value).__name__}")
         self.value: int = value
+        self._str: str = str(value)  # value is immutable, so render it once
 
     def _build(self) -> tuple[str, list[Any]]:
-        return str(self.value), []
+        return self._str, []
 
 
 class SafeSqlParam(SafeSqlBuilder):
     """class handling a SQL parameter of any type"""
+    __slots__ = ('value',)
+
     def __init__(self, value: Any) -> None:
         self.value: Any = value
 
@@ -150,25 +174,36 @@ class SafeSqlParam(SafeSqlBuilder):
 
 class SafeSqlWhitelisted(SafeSqlBuilder):
     """class allowing only a string chosen from a whitelist; use it for dynamically choosing a SQL object name"""
+    __slots__ = ('string', 'whitelist')
+
     def __init__(self, string: str, whitelist: Sequence[str]):
         if not isinstance(string, str):
             raise TypeError(f"string must be str, got {type(string).__name__}")
         if isinstance(whitelist, str) or not isinstance(whitelist, Sequence):
             raise TypeError(f"whitelist must be a Sequence[str], got {type(whitelist).__name__}")
-        if not all(isinstance(item, str) for item in whitelist):
+        if not all(type(item) is str for item in whitelist):
             raise TypeError("all elements of whitelist must be str")
 
-        if string not in whitelist:
+        # membership against the frozenset is O(1) even for large whitelists
+        wl = frozenset(whitelist)
+        if string not in wl:
             raise ValueError(f"string '{string}' not in whitelist {whitelist}")
 
         self.string = string
-        self.whitelist = frozenset(whitelist)
+        self.whitelist = wl
+
+    @classmethod
+    @lru_cache(maxsize=256)
+    def for_(cls, string: str, whitelist: frozenset[str]) -> 'SafeSqlWhitelisted':
+        """cached factory; repeated identical (string, whitelist) pairs share one builder instance"""
+        return cls(string, tuple(whitelist))
 
     def _build(self) -> tuple[str, list[Any]]:
         return self.string, []
 
 
-class SafeSqlUpsertRows(SafeSqlBuilder, BaseModel):
+@dataclass(slots=True)
+class SafeSqlUpsertRows(SafeSqlBuilder):
     """
     Class for building an upsert command sanitizing all values but no SQL names.
     It is the developer's responsibility to ensure that target_table and column names are safe strings!
@@ -177,9 +212,10 @@ class SafeSqlUpsertRows(SafeSqlBuilder, BaseModel):
     on_columns: Sequence[DeveloperCheckedStr]
     columns: Sequence[DeveloperCheckedStr]
     rows: Sequence[Sequence[Any]]
+    # columns to update on match, derived once at validation time
+    _update_columns: tuple[DeveloperCheckedStr, ...] = field(init=False, repr=False, compare=False)
 
-    @model_validator(mode="after")
-    def validate_inputs(self):
+    def __post_init__(self):
         # Check rows exist
         if not self.rows:
             raise ValueError("rows must not be empty")
@@ -194,19 +230,42 @@ class SafeSqlUpsertRows(SafeSqlBuilder, BaseModel):
         if row_length != len(self.columns):
             raise ValueError("each row must have the same length as columns")
 
+        # Build each set once and reuse it for both the repetition and the subset checks
+        on_set = frozenset(self.on_columns)
+        col_set = frozenset(self.columns)
+
         # Check there are no repeated on_columns
-        if len(set(self.on_columns)) < len(self.on_columns):
+        if len(on_set) < len(self.on_columns):
             raise ValueError("columns should contain no repetitions")
 
         # Check there are no repeated columns
-        if len(set(self.columns)) < len(self.columns):
+        if len(col_set) < len(self.columns):
             raise ValueError("columns should contain no repetitions")
 
         # Check on_columns are contained in columns
-        if not set(self.on_columns).issubset(self.columns):
+        if not on_set <= col_set:
             raise ValueError("on_columns must be a subset of columns")
 
-        return self
+        # Derive the update columns once, with frozenset lookups, instead of per _build call
+        self._update_columns = tuple(c for c in self.columns if c not in on_set)
+
+    @classmethod
+    def _unchecked(
+        cls,
+        target_table: DeveloperCheckedStr,
+        on_columns: Sequence[DeveloperCheckedStr],
+        columns: Sequence[DeveloperCheckedStr],
+        rows: Sequence[Sequence[Any]],
+    ) -> 'SafeSqlUpsertRows':
+        """construct without running __post_init__; only for data the library has already validated"""
+        obj = object.__new__(cls)
+        obj.target_table = target_table
+        obj.on_columns = on_columns
+        obj.columns = columns
+        obj.rows = rows
+        on_set = frozenset(on_columns)
+        obj._update_columns = tuple(c for c in columns if c not in on_set)
+        return obj
 
     @staticmethod
     def from_row_dicts(
@@ -221,34 +280,134 @@ class SafeSqlUpsertRows(SafeSqlBuilder, BaseModel):
         )
 
     def _build(self) -> tuple[str, list[Any]]:
-        update_columns: list[str] = [c for c in self.columns if c not in self.on_columns]
-
-        value_row: str = "(" + ",".join(self.PYODBC_PARAM_PLACEHOLDER for _ in range(len(self.columns))) + ")"
-        value_rows: str = ",".join(value_row for _ in range(len(self.rows)))
-
-        column_list: str = ",".join(c for c in self.columns)
-
-        on_condition = " AND ".join(f"target.{c} = source.{c}" for c in self.on_columns)
+        sql = _build_upsert_sql(
+            self.target_table, tuple(self.columns), tuple(self.on_columns),
+            self._update_columns, len(self.rows)
+        )
+        n_rows = len(self.rows)
+        n_cols = len(self.columns)
+        if all(type(v) is int for v in self.rows[0]):
+            # homogeneous numeric rows (sampled on the first row) flatten through an
+            # array of 64-bit ints: C-level extension instead of boxed-object copies
+            try:
+                flat = array('q')
+                for row in self.rows:
+                    flat.extend(row)
+                return sql, flat.tolist()  # pyodbc expects a list at the boundary
+            except (TypeError, OverflowError):
+                pass  # a later row was not 64-bit int after all; use the generic path
+        if n_rows * n_cols <= self.MSSQL_MAX_PARAMS:
+            # shapes that fit in one statement get a codegenned flattener, cached per shape
+            params: list[Any] = _make_params_flattener(n_rows, n_cols)(self.rows)
+        else:
+            # oversized payloads (rejected by build() anyway) fall back to slice assignment
+            params = [None] * (n_rows * n_cols)
+            for i, row in enumerate(self.rows):
+                params[i * n_cols:(i + 1) * n_cols] = row
+        return sql, params
 
-        update_command = ", ".join(f"target.{c} = source.{c}" for c in update_columns)
+    def build_batches(self) -> Iterator[tuple[str, list[Any]]]:
+        """
+        Yield (sql, params) tuples like build(), splitting the rows over as few
+        MERGE statements as possible so that none exceeds the SqlServer parameter limit.
+        """
+        n_cols = len(self.columns)
+        max_rows = self.MSSQL_MAX_PARAMS // n_cols
+        if max_rows == 0:
+            raise ValueError("a single row already exceeds the SqlServer max. nr. of parameters")
+        for start in range(0, len(self.rows), max_rows):
+            chunk = self.rows[start:start + max_rows]
+            # row shape was validated on this instance, so chunks skip re-validation
+            yield SafeSqlUpsertRows._unchecked(
+                self.target_table, self.on_columns, self.columns, chunk
+            ).build()
+
+    def to_executemany(self) -> tuple[str, list[tuple[Any, ...]]]:
+        """
+        Return a single-row MERGE statement plus the rows as tuples, ready for
+        cursor.executemany(sql, rows); combine with cursor.fast_executemany = True
+        so pyodbc sends the rows as one ODBC parameter array instead of one
+        round-trip per row.
+        """
+        sql = _build_upsert_sql(
+            self.target_table, tuple(self.columns), tuple(self.on_columns),
+            self._update_columns, 1
+        )
+        return sql, [tuple(r) for r in self.rows]
 
-        insert_column_list = ",".join(f"source.{c}" for c in self.columns)
 
-        sql = f"""
-MERGE INTO {self.target_table} WITH (HOLDLOCK) AS target
+# MERGE statement skeleton, kept as a module constant so the cached builder only
+# fills in the shape-dependent fragments instead of re-parsing an f-string
+_MERGE_TEMPLATE = """
+MERGE INTO %(target_table)s WITH (HOLDLOCK) AS target
 USING (
     VALUES
-        {value_rows}
-) AS source ({column_list})
-    ON {on_condition}
+        %(value_rows)s
+) AS source (%(column_list)s)
+    ON %(on_condition)s
 WHEN MATCHED THEN
     UPDATE SET 
-        {update_command}
+        %(update_command)s
 WHEN NOT MATCHED BY TARGET THEN
-    INSERT ({column_list})
-    VALUES ({insert_column_list});
+    INSERT (%(column_list)s)
+    VALUES (%(insert_column_list)s);
 """
 
-        params: list[Any] = list(chain.from_iterable(self.rows))
 
-        return sql, params
+@lru_cache(maxsize=256)
+def _make_params_flattener(n_rows: int, n_cols: int):
+    """
+    Codegen a flattener specialized to one (n_rows, n_cols) shape: the generated
+    function fills a fully unrolled preallocated list with plain index loads,
+    skipping all per-call loop and bounds bookkeeping. Cached per shape, so the
+    exec cost is paid once per shape reissued across batches.
+    """
+    lines = [
+        "def flatten(rows):",
+        f"    out = [None] * {n_rows * n_cols}",
+    ]
+    for i in range(n_rows):
+        lines.append(f"    row = rows[{i}]")
+        lines.extend(f"    out[{i * n_cols + j}] = row[{j}]" for j in range(n_cols))
+    lines.append("    return out")
+    namespace: dict[str, Any] = {}
+    exec("\n".join(lines), namespace)
+    return namespace["flatten"]
+
+
+@lru_cache(maxsize=256)
+def _build_upsert_sql(
+    target_table: DeveloperCheckedStr,
+    columns: tuple[DeveloperCheckedStr, ...],
+    on_columns: tuple[DeveloperCheckedStr, ...],
+    update_columns: tuple[DeveloperCheckedStr, ...],
+    n_rows: int,
+) -> str:
+    """build the MERGE statement for SafeSqlUpsertRows; cached since it depends only on the upsert shape"""
+    # interning dedupes the column names across the many upsert shapes that share them,
+    # easing allocator pressure when the template cache does miss
+    columns = tuple(intern(c) for c in columns)
+    on_columns = tuple(intern(c) for c in on_columns)
+    update_columns = tuple(intern(c) for c in update_columns)
+
+    # repeated fragments come from C-level list multiplication; list-comps instead of
+    # genexps let str.join size its result in one pass
+    value_row: str = "(" + ",".join([SafeSqlBuilder.PYODBC_PARAM_PLACEHOLDER] * len(columns)) + ")"
+    value_rows: str = ",".join([value_row] * n_rows)
+
+    column_list: str = ",".join(columns)
+
+    on_condition = " AND ".join([f"target.{c} = source.{c}" for c in on_columns])
+
+    update_command = ", ".join([f"target.{c} = source.{c}" for c in update_columns])
+
+    insert_column_list = ",".join([f"source.{c}" for c in columns])
+
+    return _MERGE_TEMPLATE % {
+        "target_table": target_table,
+        "value_rows": value_rows,
+        "column_list": column_list,
+        "on_condition": on_condition,
+        "update_command": update_command,
+        "insert_column_list": insert_column_list,
+    }
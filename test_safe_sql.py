@@ -161,6 +161,53 @@ WHEN NOT MATCHED BY TARGET THEN
     assert params1 == list(chain.from_iterable(rows))
 
 
+def test_safe_sql_upsert_rows_build_batches():
+    table = "my_table"
+    col1 = "id"
+    col2 = "value"
+    n_rows = 1200  # 2400 params in total, above the 2100 limit
+    rows = [(i, f"v{i}") for i in range(n_rows)]
+
+    upsert = SafeSqlUpsertRows(
+        target_table=table,
+        on_columns=[col1],
+        columns=[col1, col2],
+        rows=rows
+    )
+
+    with pytest.raises(ValueError):
+        upsert.build()
+
+    batches = list(upsert.build_batches())
+    assert len(batches) == 2
+    all_params = []
+    for sql, params in batches:
+        assert sql.startswith("\nMERGE INTO my_table")
+        assert len(params) <= SafeSqlUpsertRows.MSSQL_MAX_PARAMS
+        all_params.extend(params)
+    assert all_params == list(chain.from_iterable(rows))
+
+
+def test_safe_sql_upsert_rows_to_executemany():
+    table = "my_table"
+    col1 = "id"
+    col2 = "value"
+    rows = [(1, "a"), (2, "b"), (3, "c")]
+
+    upsert = SafeSqlUpsertRows(
+        target_table=table,
+        on_columns=[col1],
+        columns=[col1, col2],
+        rows=rows
+    )
+
+    sql, row_tuples = upsert.to_executemany()
+    # a single value row of placeholders, one tuple per row
+    assert "(?,?)" in sql
+    assert "(?,?),(?,?)" not in sql
+    assert row_tuples == rows
+
+
 def test_safe_sql_upsert_rows_invalid_rows_length():
     table = "my_table"
     col1 = "id"